@@ -6,12 +6,23 @@
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import functools
 import json
+import mmap
 import os
+import pickle
+import re
 import shutil
 import stat
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
 
 from .dyndeps import create_dyn_dep_munger
 from .envfuncs import Env, add_path_entry, path_search
@@ -1086,6 +1097,109 @@ install(FILES sqlite3.h sqlite3ext.h DESTINATION include)
         )
 
 
+# Non-comment Cargo.toml lines declaring a git dependency, capturing the
+# repository url so it can be mapped back to a getdeps dependency name.
+CARGO_GIT_DEP_RE = re.compile(
+    rb'^(?!\s*#)(?P<line>[^\n]*?git\s*=\s*"(?P<url>[^"]+)"[^\n]*)$', re.MULTILINE
+)
+
+# The optional package rename on a dependency line:
+#   my-rename-of-crate = { package = "crate", git = "..." }
+CARGO_PKG_RENAME_RE = re.compile(rb'package\s*=\s*"(?P<pkg>[^"]+)"')
+
+# The crate name declared by a manifest's [package] section.
+CARGO_PACKAGE_NAME_RE = re.compile(
+    rb'\[package\][^\[]*?name\s*=\s*"(?P<name>[^"]+)"', re.DOTALL
+)
+
+# A [patch."URL"] section header in a workspace manifest.
+CARGO_PATCH_HEADER_RE = re.compile(r'\[patch\."([^"]+)"\]')
+
+# How much of a Cargo.toml to read when only its leading sections are of
+# interest; the [package] clause sits at the top of a manifest.
+CARGO_HEADER_LEN = 8192
+
+
+# ioctl from <linux/fs.h> asking the filesystem to clone extents from one
+# fd to another; supported by btrfs and XFS among others.
+FICLONE = 0x40049409
+
+
+def _make_reflink_copier():
+    """Returns a copy function for shutil.copytree that tries to reflink
+    each file via the FICLONE ioctl.
+
+    A reflink is an O(1) metadata operation that shares extents
+    copy-on-write, so a cloned tree costs no data IO but later in-place
+    edits (e.g. _patchup_workspace appending to the workspace manifest)
+    never leak back into the source tree -- unlike hardlinks, which would.
+    The first file the filesystem refuses to clone disables the fast path
+    so unsupported filesystems don't pay a failed ioctl per file.
+    """
+    if fcntl is None:
+        return shutil.copy2
+
+    state = {"supported": True}
+
+    def copyfn(src, dst):
+        if state["supported"]:
+            try:
+                with open(src, "rb") as s, open(dst, "wb") as d:
+                    fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                shutil.copystat(src, dst)
+                return dst
+            except EnvironmentError:
+                state["supported"] = False
+                try:
+                    os.unlink(dst)
+                except EnvironmentError:
+                    pass
+        return shutil.copy2(src, dst)
+
+    return copyfn
+
+
+def _read_header(path, n=CARGO_HEADER_LEN):
+    """Reads up to n raw bytes from the start of path.
+
+    Uses os.open/os.read directly to skip the buffered file object and
+    utf-8 decode; the pattern matching on manifest headers is done on
+    bytes."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, n)
+    finally:
+        os.close(fd)
+
+
+# Dirs that never contain project manifests but can hold millions of
+# entries (rust build output, scm metadata, vendored node modules).
+CARGO_SKIP_DIRS = frozenset(("target", "node_modules", ".cargo"))
+
+
+def _walk_cargo_tomls(root):
+    """Yields the path of every Cargo.toml under root.
+
+    Iterative os.scandir walk that prunes build output and hidden dirs
+    (.git and friends) before descending, and classifies entries from the
+    dirent data without issuing a stat per entry."""
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            entries = os.scandir(current)
+        except EnvironmentError:
+            continue
+        with entries:
+            for entry in entries:
+                name = entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if name not in CARGO_SKIP_DIRS and not name.startswith("."):
+                        stack.append(entry.path)
+                elif name == "Cargo.toml" and entry.is_file(follow_symlinks=False):
+                    yield entry.path
+
+
 class CargoBuilder(BuilderBase):
     def __init__(
         self,
@@ -1107,10 +1221,12 @@ class CargoBuilder(BuilderBase):
         self.ws_dir = workspace_dir
         self.manifests_to_build = manifests_to_build and manifests_to_build.split(",")
         self.loader = loader
+        self._dep_to_git = None
 
-    def run_cargo(self, install_dirs, operation, args=None):
+    def run_cargo(self, install_dirs, operation, args=None, env=None):
         args = args or []
-        env = self._compute_env(install_dirs)
+        if env is None:
+            env = self._compute_env(install_dirs)
         # Enable using nightly features with stable compiler
         env["RUSTC_BOOTSTRAP"] = "1"
         env["LIBZ_SYS_STATIC"] = "1"
@@ -1134,7 +1250,7 @@ class CargoBuilder(BuilderBase):
     def recreate_dir(self, src, dst):
         if os.path.isdir(dst):
             shutil.rmtree(dst)
-        shutil.copytree(src, dst)
+        shutil.copytree(src, dst, copy_function=_make_reflink_copier())
 
     def _build(self, install_dirs, reconfigure):
         build_source_dir = self.build_source_dir()
@@ -1144,9 +1260,7 @@ class CargoBuilder(BuilderBase):
         if not os.path.isdir(dot_cargo_dir):
             os.mkdir(dot_cargo_dir)
 
-        with open(os.path.join(dot_cargo_dir, "config"), "w+") as f:
-            f.write(
-                """\
+        config_content = """\
 [build]
 target-dir = '''{}'''
 
@@ -1157,9 +1271,17 @@ git-fetch-with-cli = true
 debug = false
 incremental = false
 """.format(
-                    self.build_dir.replace("\\", "\\\\")
-                )
-            )
+            self.build_dir.replace("\\", "\\\\")
+        )
+        config_file = os.path.join(dot_cargo_dir, "config")
+        try:
+            with open(config_file, "r") as f:
+                write_needed = f.read() != config_content
+        except EnvironmentError:
+            write_needed = True
+        if write_needed:
+            with open(config_file, "w") as f:
+                f.write(config_content)
 
         if self.ws_dir is not None:
             self._patchup_workspace()
@@ -1173,11 +1295,16 @@ incremental = false
             # so just rely on cargo downloading crates on it's own
             pass
 
+        # the environment is identical for every cargo invocation in this
+        # build, so compute it once rather than per manifest
+        env = self._compute_env(install_dirs)
+
         if self.manifests_to_build is None:
             self.run_cargo(
                 install_dirs,
                 "build",
                 ["--out-dir", os.path.join(self.inst_dir, "bin"), "-Zunstable-options"],
+                env=env,
             )
         else:
             for manifest in self.manifests_to_build:
@@ -1191,6 +1318,7 @@ incremental = false
                         "--manifest-path",
                         self.manifest_dir(manifest),
                     ],
+                    env=env,
                 )
 
         self.recreate_dir(build_source_dir, os.path.join(self.inst_dir, "source"))
@@ -1203,16 +1331,18 @@ incremental = false
         else:
             args = []
 
+        env = self._compute_env(install_dirs)
+
         if self.manifests_to_build is None:
-            self.run_cargo(install_dirs, "test", args)
+            self.run_cargo(install_dirs, "test", args, env=env)
             if self.build_doc:
-                self.run_cargo(install_dirs, "doc", ["--no-deps"])
+                self.run_cargo(install_dirs, "doc", ["--no-deps"], env=env)
         else:
             for manifest in self.manifests_to_build:
                 margs = ["--manifest-path", self.manifest_dir(manifest)]
-                self.run_cargo(install_dirs, "test", args + margs)
+                self.run_cargo(install_dirs, "test", args + margs, env=env)
                 if self.build_doc:
-                    self.run_cargo(install_dirs, "doc", ["--no-deps"] + margs)
+                    self.run_cargo(install_dirs, "doc", ["--no-deps"] + margs, env=env)
 
     def _patchup_workspace(self):
         """
@@ -1235,57 +1365,83 @@ incremental = false
         producing bad results.
         """
         workspace_dir = self.workspace_dir()
-        config = self._resolve_config()
-        if config:
-            with open(os.path.join(workspace_dir, "Cargo.toml"), "r+") as f:
-                manifest_content = f.read()
+        with open(os.path.join(workspace_dir, "Cargo.toml"), "r+") as f:
+            manifest_content = f.read()
+            # collect the already patched repos once so each dep below is
+            # an O(1) set lookup instead of a scan of the manifest text
+            existing_patches = frozenset(
+                CARGO_PATCH_HEADER_RE.findall(manifest_content)
+            )
+            config = self._resolve_config(existing_patches)
+            if config:
                 if "[package]" not in manifest_content:
                     # A fake manifest has to be crated to change the virtual
                     # manifest into a non-virtual. The virtual manifests are limited
                     # in many ways and the inability to define patches on them is
                     # one. Check https://github.com/rust-lang/cargo/issues/4934 to
                     # see if it is resolved.
-                    f.write(
-                        """
+                    appendix = """
     [package]
     name = "fake_manifest_of_{}"
     version = "0.0.0"
     [lib]
     path = "/dev/null"
     """.format(
-                            self.manifest.name
-                        )
+                        self.manifest.name
                     )
                 else:
-                    f.write("\n")
-                f.write(config)
+                    appendix = "\n"
+                # batch the append into a single write
+                f.write(appendix + config)
 
-    def _resolve_config(self):
+    def _resolve_config(self, existing_patches=frozenset()):
         """
         Returns a configuration to be put inside root Cargo.toml file which
         patches the dependencies git code with local getdeps versions.
         See https://doc.rust-lang.org/cargo/reference/manifest.html#the-patch-section
+
+        Repos listed in existing_patches already have a [patch] section in
+        the manifest and are skipped.
         """
         dep_to_git = self._resolve_dep_to_git()
-        dep_to_crates = CargoBuilder._resolve_dep_to_crates(
+        dep_to_crates = self._resolve_dep_to_crates(
             self.build_source_dir(), dep_to_git
         )
 
         config = []
-        for name in sorted(dep_to_git.keys()):
-            git_conf = dep_to_git[name]
-            crates = sorted(dep_to_crates.get(name, []))
+        # deps and crates are only sorted to keep the emitted config
+        # deterministic; filter before paying for the sorts
+        for name, git_conf in sorted(dep_to_git.items()):
+            if git_conf["repo_url"] in existing_patches:
+                continue  # already patched in the manifest
+            crates = dep_to_crates.get(name)
             if not crates:
                 continue  # nothing to patch, move along
-            crates_patches = [
-                '{} = {{ path = "{}" }}'.format(
-                    crate,
-                    CargoBuilder._resolve_crate_to_path(crate, git_conf).replace(
-                        "\\", "\\\\"
-                    ),
+            # explicitly mapped crates resolve through crate.pathmap; the
+            # (memoized) crate index is only built for the rest, once per
+            # dep, so each crate below is a plain dict lookup
+            source_dir = git_conf["source_dir"]
+            crate_source_map = git_conf.get("crate_source_map") or {}
+            crate_index = None
+            crates_patches = []
+            for crate in sorted(crates):
+                crate_path = crate_source_map.get(crate)
+                if crate_path is None:
+                    if crate_index is None:
+                        crate_index = CargoBuilder._build_crate_name_index(source_dir)
+                    try:
+                        crate_path = crate_index[crate]
+                    except KeyError:
+                        raise Exception(
+                            "Failed to found crate {} in path {}".format(
+                                crate, source_dir
+                            )
+                        )
+                crates_patches.append(
+                    '{} = {{ path = "{}" }}'.format(
+                        crate, crate_path.replace("\\", "\\\\")
+                    )
                 )
-                for crate in crates
-            ]
 
             config.append(
                 '[patch."{0}"]\n'.format(git_conf["repo_url"])
@@ -1298,10 +1454,31 @@ incremental = false
         For each direct dependency of the currently build manifest check if it
         is also cargo-builded and if yes then extract it's git configs and
         install dir
+
+        The result is memoized on the builder and additionally persisted in
+        the build dir keyed by the recursive project hash, so repeated
+        getdeps runs with unchanged dependencies skip the resolution (and
+        everything downstream of it) entirely.
         """
+        if self._dep_to_git is not None:
+            return self._dep_to_git
+
+        cache_file = os.path.join(self.build_dir, "dep_to_git.json")
+        project_hash = self.loader.get_project_hash(self.manifest)
+        try:
+            with open(cache_file, "r") as f:
+                cached = json.load(f)
+            if cached.get("project_hash") == project_hash:
+                self._dep_to_git = cached["dep_to_git"]
+                return self._dep_to_git
+        except Exception:
+            # missing or stale cache; fall through to a full resolve
+            pass
+
         dependencies = self.manifest.get_section_as_dict("dependencies", ctx=self.ctx)
         if not dependencies:
-            return []
+            self._dep_to_git = {}
+            return self._dep_to_git
 
         dep_to_git = {}
         for dep in dependencies.keys():
@@ -1314,7 +1491,10 @@ incremental = false
                 # toolchain.
                 continue
 
-            git_conf = dep_manifest.get_section_as_dict("git", ctx=self.ctx)
+            sections = dep_manifest.get_sections_as_dict(
+                ["git", "crate.pathmap"], ctx=self.ctx
+            )
+            git_conf = sections["git"]
             if "repo_url" not in git_conf:
                 raise Exception(
                     "A cargo dependency requires git.repo_url to be defined."
@@ -1323,53 +1503,147 @@ incremental = false
             if dep_builder == "cargo":
                 source_dir = os.path.join(source_dir, "source")
             git_conf["source_dir"] = source_dir
+            pathmap = sections["crate.pathmap"]
+            git_conf["crate_source_map"] = {
+                crate: os.path.join(source_dir, subpath)
+                for crate, subpath in pathmap.items()
+            }
             dep_to_git[dep] = git_conf
+
+        self._dep_to_git = dep_to_git
+        try:
+            with open(cache_file, "w") as f:
+                json.dump({"project_hash": project_hash, "dep_to_git": dep_to_git}, f)
+        except EnvironmentError:
+            pass
         return dep_to_git
 
     @staticmethod
-    def _resolve_dep_to_crates(build_source_dir, dep_to_git):
+    def _manifest_fingerprint(build_source_dir, dep_to_git):
+        """
+        Computes a cheap stat-only fingerprint of all the Cargo.toml files
+        under build_source_dir, combined with the dependency configuration.
+        The fingerprint changes whenever a manifest is added, removed or
+        modified, or whenever the set of cargo dependencies changes, so it
+        can be used to detect when a cached crate scan is still valid.
+        """
+        entries = []
+        for manifest in _walk_cargo_tomls(build_source_dir):
+            st = os.stat(manifest)
+            entries.append(
+                (
+                    os.path.relpath(manifest, build_source_dir),
+                    st.st_mtime_ns,
+                    st.st_size,
+                )
+            )
+        entries.sort()
+        deps = sorted((name, conf["repo_url"]) for name, conf in dep_to_git.items())
+        return (deps, entries)
+
+    def _resolve_dep_to_crates(self, build_source_dir, dep_to_git):
         """
         This function traverse the build_source_dir in search of Cargo.toml
         files, extracts the crate names from them using _extract_crates
         function and returns a merged result containing crate names per
         dependency name from all Cargo.toml files in the project.
+
+        Scanning every manifest is IO-bound and the result only depends on
+        the manifests and the dependency configuration, so the result is
+        cached in the build dir keyed by a stat fingerprint of the tree and
+        reused as long as nothing changed.
         """
         if not dep_to_git:
             return {}  # no deps, so don't waste time traversing files
 
+        if all(conf.get("crate_source_map") for conf in dep_to_git.values()):
+            # every dep declares its crates explicitly via crate.pathmap,
+            # so there is nothing to discover by scanning the build tree
+            return {
+                name: set(conf["crate_source_map"].keys())
+                for name, conf in dep_to_git.items()
+            }
+
+        cache_file = os.path.join(self.build_dir, "_manifest_cache.pkl")
+        fingerprint = CargoBuilder._manifest_fingerprint(build_source_dir, dep_to_git)
+        try:
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("fingerprint") == fingerprint:
+                return cached["dep_to_crates"]
+        except Exception:
+            # a missing or unreadable cache simply means a full scan
+            pass
+
+        repo_url_to_dep = {
+            conf["repo_url"]: name for name, conf in dep_to_git.items()
+        }
+        manifest_files = list(_walk_cargo_tomls(build_source_dir))
+
         dep_to_crates = {}
-        for root, _, files in os.walk(build_source_dir):
-            for f in files:
-                if f == "Cargo.toml":
-                    more_dep_to_crates = CargoBuilder._extract_crates(
-                        os.path.join(root, f), dep_to_git
-                    )
+        if manifest_files:
+            # the per-manifest scans are independent and IO-bound, so run
+            # them concurrently; the GIL is released during the reads
+            with ThreadPoolExecutor(
+                max_workers=min(32, len(manifest_files))
+            ) as executor:
+                results = executor.map(
+                    lambda path: CargoBuilder._extract_crates(path, repo_url_to_dep),
+                    manifest_files,
+                )
+                for more_dep_to_crates in results:
                     for name, crates in more_dep_to_crates.items():
                         dep_to_crates.setdefault(name, set()).update(crates)
+
+        try:
+            with open(cache_file, "wb") as f:
+                pickle.dump(
+                    {"fingerprint": fingerprint, "dep_to_crates": dep_to_crates},
+                    f,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+        except EnvironmentError:
+            # failing to persist the cache is not fatal; the next run
+            # just scans the manifests again
+            pass
         return dep_to_crates
 
     @staticmethod
-    def _extract_crates(cargo_toml_file, dep_to_git):
+    def _extract_crates(cargo_toml_file, repo_url_to_dep):
         """
         This functions reads content of provided cargo toml file and extracts
         crate names per each dependency. The extraction is done by a heuristic
         so it might be incorrect.
+
+        repo_url_to_dep maps a git repo_url to a dependency name; a single
+        compiled regex is run over the whole (mmapped) file instead of
+        scanning every line against every dependency.
         """
         deps_to_crates = {}
-        with open(cargo_toml_file, "r") as f:
-            for line in f.readlines():
-                if line.startswith("#") or "git = " not in line:
-                    continue  # filter out commented lines and ones without git deps
-                for name, conf in dep_to_git.items():
-                    if 'git = "{}"'.format(conf["repo_url"]) in line:
-                        pkg_template = ' package = "'
-                        if pkg_template in line:
-                            crate_name, _, _ = line.partition(pkg_template)[
-                                2
-                            ].partition('"')
-                        else:
-                            crate_name, _, _ = line.partition("=")
-                        deps_to_crates.setdefault(name, set()).add(crate_name.strip())
+        with open(cargo_toml_file, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size > 64 * 1024:
+                # large workspace manifests are scanned in place instead
+                # of copied into a python bytes object
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+            if buf.find(b"git") == -1:
+                # cheap C-level prefilter: most manifests declare no git
+                # dependencies at all, so skip the regex scan outright
+                return deps_to_crates
+            for m in CARGO_GIT_DEP_RE.finditer(buf):
+                name = repo_url_to_dep.get(m.group("url").decode("utf-8"))
+                if name is None:
+                    continue
+                rename = CARGO_PKG_RENAME_RE.search(m.group("line"))
+                if rename:
+                    crate_name = rename.group("pkg")
+                else:
+                    crate_name, _, _ = m.group("line").partition(b"=")
+                deps_to_crates.setdefault(name, set()).add(
+                    crate_name.strip().decode("utf-8")
+                )
         return deps_to_crates
 
     @staticmethod
@@ -1379,13 +1653,33 @@ incremental = false
         keyword followed by name = "<crate>".
         """
         source_dir = git_conf["source_dir"]
-        search_pattern = '[package]\nname = "{}"'.format(crate)
-
-        for root, _, files in os.walk(source_dir):
-            for fname in files:
-                if fname == "Cargo.toml":
-                    with open(os.path.join(root, fname), "r") as f:
-                        if search_pattern in f.read():
-                            return root
+        index = CargoBuilder._build_crate_name_index(source_dir)
+        try:
+            return index[crate]
+        except KeyError:
+            raise Exception(
+                "Failed to found crate {} in path {}".format(crate, source_dir)
+            )
 
-        raise Exception("Failed to found crate {} in path {}".format(crate, source_dir))
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _build_crate_name_index(source_dir):
+        """
+        Walks source_dir once and maps every crate name declared by a
+        [package] section to the directory of its Cargo.toml.  The result
+        is memoized so resolving K crates costs one traversal instead of
+        one traversal per crate.
+        """
+        index = {}
+        for manifest_file in _walk_cargo_tomls(source_dir):
+            header = _read_header(manifest_file)
+            m = CARGO_PACKAGE_NAME_RE.search(header)
+            if not m and len(header) == CARGO_HEADER_LEN:
+                # unusually large preamble; fall back to the whole file
+                with open(manifest_file, "rb") as f:
+                    m = CARGO_PACKAGE_NAME_RE.search(f.read())
+            if m:
+                index.setdefault(
+                    m.group("name").decode("utf-8"), os.path.dirname(manifest_file)
+                )
+        return index
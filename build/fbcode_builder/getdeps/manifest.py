@@ -81,6 +81,10 @@ SCHEMA = {
             "manifests_to_build": OPTIONAL,
         },
     },
+    # maps crate names to their subdir within the project source so that
+    # cargo builds depending on this project don't have to discover the
+    # crates by scanning every Cargo.toml in the install dir
+    "crate.pathmap": {"optional_section": True},
     "cmake.defines": {"optional_section": True},
     "autoconf.args": {"optional_section": True},
     "rpms": {"optional_section": True},
@@ -303,6 +307,26 @@ class ManifestParser(object):
                 d[field] = value
         return d
 
+    def get_sections_as_dict(self, sections, ctx=None):
+        """Batched form of get_section_as_dict: collects several sections
+        in a single pass over the parsed config and returns a dict mapping
+        each requested section name to its get_section_as_dict result."""
+        d = {section: {} for section in sections}
+        ctx = ctx or {}
+
+        for s in self._config.sections():
+            for section in sections:
+                if s != section:
+                    if not s.startswith(section + "."):
+                        continue
+                    expr = parse_conditional_section_name(s, section)
+                    if not expr.eval(ctx):
+                        continue
+                for field in self._config.options(s):
+                    value = self._config.get(s, field)
+                    d[section][field] = value
+        return d
+
     def update_hash(self, hasher, ctx):
         """Compute a hash over the configuration for the given
         context.  The goal is for the hash to change if the config
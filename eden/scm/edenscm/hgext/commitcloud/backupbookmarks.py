@@ -9,7 +9,6 @@ import hashlib
 import json
 import os
 import re
-import socket
 
 from edenscm.mercurial import (
     encoding,
@@ -22,7 +21,7 @@ from edenscm.mercurial import (
 )
 from edenscm.mercurial.i18n import _
 
-from . import dependencies
+from . import dependencies, util as ccutil
 
 
 prefix = "infinitepushbackups/infinitepushbackupstate"
@@ -52,7 +51,7 @@ def _unescapebookmark(bookmark):
 def backuphostname(repo):
     hostname = repo.ui.config("infinitepushbackup", "hostname")
     if not hostname:
-        hostname = socket.gethostname()
+        hostname = ccutil.gethostname()
     return hostname
 
 
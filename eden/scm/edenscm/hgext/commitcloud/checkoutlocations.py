@@ -5,7 +5,6 @@
 
 from __future__ import absolute_import
 
-import socket
 
 from edenscm.mercurial import perftrace, util
 
@@ -26,7 +25,7 @@ def send(ui, repo, parent1, **kwargs):
             return
         tokenlocator = token.TokenLocator(ui)
         serv = service.get(ui, tokenlocator.token)
-        hostname = socket.gethostname()
+        hostname = ccutil.gethostname()
         sharedpath = repo.sharedpath
         checkoutpath = repo.path
         unixname = ui.username()
@@ -11,11 +11,24 @@ from . import httpsservice, localservice
 
 
 def get(ui, token=None):
+    """Obtains a commit cloud service for the given ui
+
+    The service is constructed from configuration that doesn't change
+    within a process, so it is cached on the ui object and reused by
+    subsequent sync operations.
+    """
+    cached = getattr(ui, "_commitcloudservice", None)
+    if cached is not None and cached[0] == token:
+        return cached[1]
+
     servicetype = ui.config("commitcloud", "servicetype")
     if servicetype == "local":
-        return localservice.LocalService(ui)
+        serv = localservice.LocalService(ui)
     elif servicetype == "remote":
-        return httpsservice.HttpsCommitCloudService(ui, token)
+        serv = httpsservice.HttpsCommitCloudService(ui, token)
     else:
         msg = "Unrecognized commitcloud.servicetype: %s" % servicetype
         raise error.Abort(msg)
+
+    ui._commitcloudservice = (token, serv)
+    return serv
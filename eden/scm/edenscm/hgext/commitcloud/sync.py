@@ -7,7 +7,6 @@ from __future__ import absolute_import
 
 import itertools
 import re
-import socket
 import time
 
 from edenscm.mercurial import (
@@ -876,7 +875,7 @@ def _mergebookmarks(repo, tr, cloudbookmarks, lastsyncstate):
 
 
 def _forkname(ui, name, othernames):
-    hostname = ui.config("commitcloud", "hostname", socket.gethostname())
+    hostname = ui.config("commitcloud", "hostname", ccutil.gethostname())
 
     # Strip off any old suffix.
     m = re.match("-%s(-[0-9]*)?$" % re.escape(hostname), name)
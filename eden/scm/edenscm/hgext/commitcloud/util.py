@@ -6,6 +6,7 @@
 from __future__ import absolute_import
 
 import os
+import socket
 
 from edenscm.mercurial import commands, encoding, error, pycompat, util
 from edenscm.mercurial.i18n import _
@@ -16,6 +17,21 @@ from . import dependencies, error as ccerror
 SERVICE = "commitcloud"
 ACCOUNT = "commitcloud"
 
+_hostname = None
+
+
+def gethostname():
+    """returns the machine hostname, computed at most once per process
+
+    The hostname only changes on reboot, and socket.gethostname can block
+    on DNS in misconfigured environments, so don't make the call more than
+    once.
+    """
+    global _hostname
+    if _hostname is None:
+        _hostname = socket.gethostname()
+    return _hostname
+
 
 def getuserconfigpath(ui, overrideconfig):
     """returns the path for per-user configuration
@@ -3,11 +3,11 @@
 # This software may be used and distributed according to the terms of the
 # GNU General Public License version 2.
 
-import socket
-
 from edenscm.mercurial import config, error, pycompat, util
 from edenscm.mercurial.i18n import _
 
+from . import util as ccutil
+
 
 workspaceopts = [
     (
@@ -100,7 +100,7 @@ def hostnameworkspace(ui, user=None):
         user = util.emaildomainuser(ui.username(), domain)
     return "user/%s/%s" % (
         user,
-        ui.config("commitcloud", "hostname", socket.gethostname()),
+        ui.config("commitcloud", "hostname", ccutil.gethostname()),
     )
 
 
@@ -3032,6 +3032,9 @@ class arbitraryfilectx(object):
     def data(self):
         return util.readfile(self._path)
 
+    def size(self):
+        return os.path.getsize(self._path)
+
     def decodeddata(self):
         with open(self._path, "rb") as f:
             return f.read()
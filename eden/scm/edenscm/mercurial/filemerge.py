@@ -12,8 +12,10 @@
 
 from __future__ import absolute_import
 
+import collections
 import os
 import re
+import shutil
 import subprocess
 import tempfile
 
@@ -35,16 +37,49 @@ from .i18n import _
 from .node import nullid, short
 
 
+def _toolcfgcache(ui):
+    # Tool config is consulted around a dozen times per merged file; memoize
+    # the parsed values on the ui so an N-file merge does each lookup once.
+    # Invalid values (e.g. a bad boolean) keep raising on every access since
+    # only successful lookups are cached.
+    cache = getattr(ui, "_mergetoolcfg", None)
+    if cache is None:
+        cache = ui._mergetoolcfg = {}
+    return cache
+
+
 def _toolstr(ui, tool, part, *args):
-    return ui.config("merge-tools", tool + "." + part, *args)
+    cache = _toolcfgcache(ui)
+    key = ("str", tool, part, args)
+    try:
+        return cache[key]
+    except KeyError:
+        value = ui.config("merge-tools", tool + "." + part, *args)
+        cache[key] = value
+        return value
 
 
 def _toolbool(ui, tool, part, *args):
-    return ui.configbool("merge-tools", tool + "." + part, *args)
+    cache = _toolcfgcache(ui)
+    key = ("bool", tool, part, args)
+    try:
+        return cache[key]
+    except KeyError:
+        value = ui.configbool("merge-tools", tool + "." + part, *args)
+        cache[key] = value
+        return value
 
 
 def _toollist(ui, tool, part):
-    return ui.configlist("merge-tools", tool + "." + part)
+    cache = _toolcfgcache(ui)
+    key = ("list", tool, part)
+    try:
+        return cache[key]
+    except KeyError:
+        # a tuple, so no caller can mutate the cached value for everyone else
+        value = tuple(ui.configlist("merge-tools", tool + "." + part))
+        cache[key] = value
+        return value
 
 
 internals = {}
@@ -58,6 +93,24 @@ nomerge = internaltool.nomerge
 mergeonly = internaltool.mergeonly  # just the full merge, no premerge
 fullmerge = internaltool.fullmerge  # both premerge and merge
 
+_contextmod = None
+
+
+def _context():
+    """Returns the context module, importing it lazily.
+
+    filemerge can't import context at module scope (filectx -> ctx ->
+    fileset -> merge -> filemerge), but running the import machinery on
+    every merged file is wasteful, so stash the module the first time.
+    """
+    global _contextmod
+    if _contextmod is None:
+        from . import context
+
+        _contextmod = context
+    return _contextmod
+
+
 _localchangedotherdeletedmsg = _(
     "local%(l)s changed %(fd)s which other%(o)s deleted\n"
     "use (c)hanged version, (d)elete, or leave (u)nresolved?"
@@ -71,6 +124,14 @@ _otherchangedlocaldeletedmsg = _(
     "$$ &Changed $$ &Deleted $$ &Unresolved $$ &Renamed"
 )
 
+_mergesuccessmsg = _("was merge of '%s' successful (yn)?" "$$ &Yes $$ &No")
+
+_outputunchangedmsg = _(
+    " output file %s appears unchanged\n"
+    "was merge successful (yn)?"
+    "$$ &Yes $$ &No"
+)
+
 
 class absentfilectx(object):
     """Represents a file that's ostensibly in a context but is actually not
@@ -119,10 +180,30 @@ class absentfilectx(object):
         return True
 
 
+def _toolpathcache(ui):
+    """Returns the per-ui cache of resolved merge tool paths.
+
+    Resolving an external tool probes the registry and stats every $PATH
+    entry, and the same small set of tools is probed for every file in a
+    merge, so cache the result.  Tool locations don't change mid-process,
+    hence no invalidation.
+    """
+    cache = getattr(ui, "_mergetoolpaths", None)
+    if cache is None:
+        cache = ui._mergetoolpaths = {}
+    return cache
+
+
 def _findtool(ui, repo, tool):
     if tool in internals:
         return tool
-    return _findexternaltoolwithreporoot(ui, repo, tool)
+    cache = _toolpathcache(ui)
+    try:
+        return cache[("reporoot", tool)]
+    except KeyError:
+        path = _findexternaltoolwithreporoot(ui, repo, tool)
+        cache[("reporoot", tool)] = path
+        return path
 
 
 def _findexternaltoolinternal(ui, tool):
@@ -139,7 +220,13 @@ def _findexternaltoolinternal(ui, tool):
 
 
 def findexternaltool(ui, tool):
-    return util.findexe(util.expandpath(_findexternaltoolinternal(ui, tool)))
+    cache = _toolpathcache(ui)
+    try:
+        return cache[("path", tool)]
+    except KeyError:
+        path = util.findexe(util.expandpath(_findexternaltoolinternal(ui, tool)))
+        cache[("path", tool)] = path
+        return path
 
 
 def _findexternaltoolwithreporoot(ui, repo, tool):
@@ -207,15 +294,47 @@ def _picktool(repo, ui, path, binary, symlink, changedelete):
             ui.debug("picktool() hgmerge %s\n" % hgmerge)
             return (hgmerge, hgmerge)
 
-    # then patterns
-    for pat, tool in ui.configitems("merge-patterns"):
-        mf = match.match(repo.root, "", [pat])
+    # then patterns; compile the matchers once per-ui instead of once per
+    # (file, pattern) pair
+    cached = getattr(ui, "_mergepatterns", None)
+    if cached is None or cached[0] != repo.root:
+        patterns = [
+            (pat, tool, match.match(repo.root, "", [pat]))
+            for pat, tool in ui.configitems("merge-patterns")
+        ]
+        ui._mergepatterns = cached = (repo.root, patterns)
+    for pat, tool, mf in cached[1]:
         if mf(path) and check(tool, pat, symlink, False, changedelete):
             toolpath = _findtool(ui, repo, tool)
             ui.debug("picktool() merge-patterns tool=%s pat=%s\n" % (toolpath, pat))
             return (tool, util.shellquote(toolpath))
 
-    # then merge tools
+    # then merge tools; the scan only depends on the file's type flags, not
+    # on the file itself, so cache the result per-ui to avoid re-reading the
+    # [merge-tools] config for every file in a large merge
+    cache = getattr(ui, "_picktoolcache", None)
+    if cache is None:
+        cache = ui._picktoolcache = {}
+    key = (binary, symlink, changedelete)
+    try:
+        tool, toolpath, warnnotool = cache[key]
+    except KeyError:
+        tool, toolpath, warnnotool = _scantools(
+            repo, ui, binary, symlink, changedelete, check
+        )
+        cache[key] = (tool, toolpath, warnnotool)
+    if warnnotool:
+        # any tool is rejected by capability for symlink or binary
+        ui.warn(_("no tool found to merge %s\n") % path)
+    return (tool, toolpath)
+
+
+def _scantools(repo, ui, binary, symlink, changedelete, check):
+    """Scan the [merge-tools] config for a usable tool.
+
+    Returns ``(tool, toolpath, warnnotool)``; ``warnnotool`` asks the caller
+    to emit the per-file "no tool found" warning.
+    """
     tools = {}
     disabled = set()
     for k, v in ui.configitems("merge-tools"):
@@ -243,48 +362,70 @@ def _picktool(repo, ui, path, binary, symlink, changedelete):
                 "picktool() uimerge merge:interactive=%s merge=%s\n"
                 % (ui.config("ui", "merge:interactive"), ui.config("ui", "merge"))
             )
-            return (uimerge, uimerge)
+            return (uimerge, uimerge, False)
         tools.insert(0, (None, uimerge))  # highest priority
     tools.append((None, "hgmerge"))  # the old default, if found
     for p, t in tools:
         if check(t, None, symlink, binary, changedelete):
             toolpath = _findtool(ui, repo, t)
             ui.debug("picktool() tools\n")
-            return (t, util.shellquote(toolpath))
+            return (t, util.shellquote(toolpath), False)
 
     # internal merge or prompt as last resort
     if symlink or binary or changedelete:
-        if not changedelete and len(tools):
-            # any tool is rejected by capability for symlink or binary
-            ui.warn(_("no tool found to merge %s\n") % path)
-        return ":prompt", None
+        return ":prompt", None, not changedelete and len(tools) > 0
     ui.debug("picktool() :merge\n")
-    return ":merge", None
+    return ":merge", None, False
 
 
 def _eoltype(data):
-    "Guess the EOL type of a file"
+    "Guess the EOL type of a file from its dominant line ending"
     if b"\0" in data:  # binary
         return None
-    if b"\r\n" in data:  # Windows
-        return b"\r\n"
-    if b"\r" in data:  # Old Mac
-        return b"\r"
-    if b"\n" in data:  # UNIX
-        return b"\n"
+    # bytes.count runs at memchr speed; picking the most frequent style means
+    # one stray ending in a mixed file can't steer the whole-file rewrite in
+    # the wrong direction.  Ties keep the old CRLF > CR > LF precedence.
+    crlf = data.count(b"\r\n")
+    cr = data.count(b"\r") - crlf
+    lf = data.count(b"\n") - crlf
+    if crlf and crlf >= cr and crlf >= lf:
+        return b"\r\n"  # Windows
+    if cr and cr >= lf:
+        return b"\r"  # Old Mac
+    if lf:
+        return b"\n"  # UNIX
     return None  # unknown
 
 
 def _matcheol(file, back):
     "Convert EOL markers in a file to match origfile"
     tostyle = _eoltype(back.data())  # No repo.wread filters?
-    if tostyle:
-        data = util.readfile(file)
-        style = _eoltype(data)
-        if style:
+    if not tostyle:
+        return
+    # Peek at the head of the file first; when it already rules out a
+    # rewrite, the full read/replace/write can be skipped.
+    with open(file, "rb") as fp:
+        head = fp.read(65536)
+        if b"\0" in head:  # binary, leave it alone
+            return
+        data = head
+        if len(head) == 65536:
+            data += fp.read()
+    style = _eoltype(data)
+    if style and style != tostyle:
+        if style == b"\r\n":
             newdata = data.replace(style, tostyle)
-            if newdata != data:
-                util.writefile(file, newdata)
+        else:
+            # protect CRLF pairs from being corrupted by a bare-\r or
+            # bare-\n replacement; NUL is a safe placeholder since binary
+            # data was screened out above
+            newdata = (
+                data.replace(b"\r\n", b"\0")
+                .replace(style, tostyle)
+                .replace(b"\0", b"\r\n")
+            )
+        if newdata != data:
+            util.writefile(file, newdata)
 
 
 @internaltool("prompt", nomerge)
@@ -447,41 +588,60 @@ def _underlyingfctxifabsent(filectx):
         return filectx
 
 
-def _premerge(repo, fcd, fco, fca, toolconf, files, labels=None):
-    tool, toolpath, binary, symlink = toolconf
-    if symlink or fcd.isabsent() or fco.isabsent():
-        return 1
-    unused, unused, unused, back = files
+_validkeep = ("keep", "keep-merge3")
 
-    ui = repo.ui
 
-    validkeep = ["keep", "keep-merge3"]
+def _premergedecision(ui, tool, binary):
+    """Resolve merge-tools.<tool>.premerge to True, False or a "keep" string.
 
-    # do we attempt to simplemerge first?
+    The exception-driven boolean-or-keyword parsing is too slow to repeat for
+    every file, so the outcome is memoized per (tool, binary); invalid values
+    are never cached and keep raising ConfigError.
+    """
+    cache = _toolcfgcache(ui)
+    key = ("premerge", tool, binary)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
     try:
         premerge = _toolbool(ui, tool, "premerge", not binary)
     except error.ConfigError:
         premerge = _toolstr(ui, tool, "premerge", "").lower()
-        if premerge not in validkeep:
-            _valid = ", ".join(["'" + v + "'" for v in validkeep])
+        if premerge not in _validkeep:
+            _valid = ", ".join(["'" + v + "'" for v in _validkeep])
             raise error.ConfigError(
                 _("%s.premerge not valid " "('%s' is neither boolean nor %s)")
                 % (tool, premerge, _valid)
             )
+    cache[key] = premerge
+    return premerge
+
+
+def _premerge(repo, fcd, fco, fca, toolconf, files, labels=None):
+    tool, toolpath, binary, symlink = toolconf
+    if symlink or fcd.isabsent() or fco.isabsent():
+        return 1
+    unused, unused, unused, back = files
+
+    ui = repo.ui
+
+    # do we attempt to simplemerge first?
+    premerge = _premergedecision(ui, tool, binary)
 
     if premerge:
         if premerge == "keep-merge3":
             if not labels:
-                labels = _defaultconflictlabels
-            if len(labels) < 3:
-                labels.append("base")
+                labels = _defaultconflictlabels3
+            elif len(labels) < 3:
+                labels = list(labels) + ["base"]
         r = simplemerge.simplemerge(ui, fcd, fca, fco, quiet=True, label=labels)
         if not r:
             ui.debug(" premerge successful\n")
             return 0
-        if premerge not in validkeep:
+        if premerge not in _validkeep:
             # restore from backup and try again
-            _restorebackup(fcd, back)
+            _restorebackup(repo, fcd, back)
     return 1  # continue merging
 
 
@@ -604,9 +764,9 @@ def _imerge3(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
     the partially merged file. Marker will have three sections, one from each
     side of the merge and one for the base content."""
     if not labels:
-        labels = _defaultconflictlabels
-    if len(labels) < 3:
-        labels.append("base")
+        labels = _defaultconflictlabels3
+    elif len(labels) < 3:
+        labels = list(labels) + ["base"]
     return _imerge(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels)
 
 
@@ -624,9 +784,9 @@ def _imergediff(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None)
     content from one side of the merge, and one with a diff from the base
     content to the content on the other side. (experimental)"""
     if not labels:
-        labels = _defaultconflictlabels
-    if len(labels) < 3:
-        labels = labels + ["base"]
+        labels = _defaultconflictlabels3
+    elif len(labels) < 3:
+        labels = list(labels) + ["base"]
     return _merge(
         repo, mynode, orig, fcd, fco, fca, toolconf, files, labels, "mergediff"
     )
@@ -680,7 +840,7 @@ def _idump(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
     a = _workingpath(repo, fcd)
     fd = fcd.path()
 
-    from . import context
+    context = _context()
 
     if isinstance(fcd, context.overlayworkingfilectx):
         raise error.InMemoryMergeConflictsError(
@@ -719,6 +879,11 @@ def _xmergeimm(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
     )
 
 
+# the placeholders util.interpolate would build a pattern for on every call;
+# compiled once since the mapping keys never change
+_xmergeargre = re.compile(r"\$(local|base|other|output)")
+
+
 def _xmerge(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
     tool, toolpath, binary, symlink = toolconf
     if fcd.isabsent() or fco.isabsent():
@@ -729,20 +894,31 @@ def _xmerge(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
         return False, 1, None
     unused, unused, unused, back = files
     a = _workingpath(repo, fcd)
-    b, c = _maketempfiles(repo, fco, fca)
+    tmpdir = tempfile.mkdtemp(prefix="hgmerge-")
     try:
+        b, c = _maketempfiles(repo, fco, fca, tmpdir)
         out = ""
-        env = {
-            "HGEDITOR": repo.ui.geteditor(),
-            "HG_FILE": fcd.path(),
-            "HG_MY_NODE": short(mynode),
-            "HG_OTHER_NODE": str(fco.changectx()),
-            "HG_BASE_NODE": str(fca.changectx()),
-            "HG_MY_ISLINK": "l" in fcd.flags(),
-            "HG_OTHER_ISLINK": "l" in fco.flags(),
-            "HG_BASE_ISLINK": "l" in fca.flags(),
-        }
+        fdflags = fcd.flags()
+        foflags = fco.flags()
+        faflags = fca.flags()
         ui = repo.ui
+        # the editor and node parts of the environment are shared by every
+        # file of a merge operation; format them once and cache on the ui
+        envkey = (mynode, fco.changectx().node(), fca.changectx().node())
+        cached = getattr(ui, "_xmergeenvbase", None)
+        if cached is None or cached[0] != envkey:
+            envbase = {
+                "HGEDITOR": ui.geteditor(),
+                "HG_MY_NODE": short(mynode),
+                "HG_OTHER_NODE": str(fco.changectx()),
+                "HG_BASE_NODE": str(fca.changectx()),
+            }
+            ui._xmergeenvbase = cached = (envkey, envbase)
+        env = cached[1].copy()
+        env["HG_FILE"] = fcd.path()
+        env["HG_MY_ISLINK"] = "l" in fdflags
+        env["HG_OTHER_ISLINK"] = "l" in foflags
+        env["HG_BASE_ISLINK"] = "l" in faflags
 
         args = _toolstr(ui, tool, "args")
         if "$output" in args:
@@ -750,8 +926,8 @@ def _xmerge(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
             out = a
             a = repo.wvfs.join(back.path())
         replace = {"local": a, "base": b, "other": c, "output": out}
-        args = util.interpolate(
-            r"\$", replace, args, lambda s: util.shellquote(util.localpath(s))
+        args = _xmergeargre.sub(
+            lambda m: util.shellquote(util.localpath(replace[m.group(1)])), args
         )
         cmd = toolpath + " " + args
         if _toolbool(ui, tool, "gui"):
@@ -763,8 +939,7 @@ def _xmerge(repo, mynode, orig, fcd, fco, fca, toolconf, files, labels=None):
         repo.ui.debug("merge tool returned: %d\n" % r)
         return True, r, False
     finally:
-        util.unlink(b)
-        util.unlink(c)
+        shutil.rmtree(tmpdir, ignore_errors=True)
 
 
 def _formatconflictmarker(repo, ctx, template, label, pad):
@@ -785,14 +960,21 @@ def _formatconflictmarker(repo, ctx, template, label, pad):
     label = ("%s:" % label).ljust(pad + 1)
     mark = "%s %s" % (label, templateresult)
 
-    if mark:
-        mark = mark.splitlines()[0]  # split for safety
+    # truncate to the first line for safety; find() avoids the list of every
+    # line splitlines() would build for multi-line template output
+    for sep in ("\n", "\r"):
+        end = mark.find(sep)
+        if end >= 0:
+            mark = mark[:end]
 
     # 8 for the prefix of conflict marker lines (e.g. '<<<<<<< ')
     return util.ellipsis(mark, 80 - 8)
 
 
-_defaultconflictlabels = ["local", "other"]
+# tuples so that a stray append can't corrupt the defaults for later calls
+_defaultconflictlabels = ("local", "other")
+
+_defaultconflictlabels3 = ("local", "other", "base")
 
 
 def _formatlabels(repo, fcd, fco, fca, labels):
@@ -806,8 +988,13 @@ def _formatlabels(repo, fcd, fco, fca, labels):
 
     ui = repo.ui
     template = ui.config("ui", "mergemarkertemplate")
-    template = templater.unquotestring(template)
-    tmpl = formatter.maketemplater(ui, template)
+    # template compilation (tokenize + parse) is too expensive to redo per
+    # file; cache the compiled template on the ui keyed by the raw string
+    cached = getattr(ui, "_mergemarkertmpl", None)
+    if cached is None or cached[0] != template:
+        tmpl = formatter.maketemplater(ui, templater.unquotestring(template))
+        ui._mergemarkertmpl = cached = (template, tmpl)
+    tmpl = cached[1]
 
     pad = max(len(l) for l in labels)
 
@@ -831,10 +1018,19 @@ def partextras(labels):
     return {"l": " [%s]" % labels[0], "o": " [%s]" % labels[1]}
 
 
-def _restorebackup(fcd, back):
-    # TODO: Add a workingfilectx.write(otherfilectx) path so we can use
-    # util.copy here instead.
-    fcd.write(back.data(), fcd.flags())
+def _restorebackup(repo, fcd, back):
+    context = _context()
+    if isinstance(fcd, context.workingfilectx) and isinstance(
+        back, context.arbitraryfilectx
+    ):
+        # both sides live on disk: copy at the file level so the backup
+        # contents never have to be materialized in memory and the kernel
+        # fast path in util.copyfile applies
+        util.copyfile(back._path, _workingpath(repo, fcd))
+    else:
+        # TODO: Add a workingfilectx.write(otherfilectx) path so we can use
+        # util.copy here instead.
+        fcd.write(back.data(), fcd.flags())
 
 
 def _makebackup(repo, ui, wctx, fcd, premerge):
@@ -850,9 +1046,7 @@ def _makebackup(repo, ui, wctx, fcd, premerge):
     """
     if fcd.isabsent():
         return None
-    # TODO: Break this import cycle somehow. (filectx -> ctx -> fileset ->
-    # merge -> filemerge). (I suspect the fileset import is the weakest link)
-    from . import context
+    context = _context()
 
     a = _workingpath(repo, fcd)
     back = scmutil.origpath(ui, repo, a)
@@ -882,19 +1076,37 @@ def _makebackup(repo, ui, wctx, fcd, premerge):
         return context.arbitraryfilectx(back, repo=repo)
 
 
-def _maketempfiles(repo, fco, fca):
-    """Writes out `fco` and `fca` as temporary files, so an external merge
-    tool may use them.
+def _maketempfiles(repo, fco, fca, tmpdir):
+    """Writes out `fco` and `fca` as temporary files in `tmpdir`, so an
+    external merge tool may use them.
+
+    The caller owns `tmpdir` (one fresh directory per merge invocation), so
+    names inside it can be built deterministically instead of paying for a
+    mkstemp probe loop per file.
     """
 
     def temp(prefix, ctx):
         fullbase, ext = os.path.splitext(ctx.path())
-        pre = "%s~%s." % (os.path.basename(fullbase), prefix)
-        (fd, name) = tempfile.mkstemp(prefix=pre, suffix=ext)
-        data = repo.wwritedata(ctx.path(), ctx.data())
-        f = util.fdopen(fd, "wb")
-        f.write(data)
-        f.close()
+        name = os.path.join(
+            tmpdir, "%s~%s%s" % (os.path.basename(fullbase), prefix, ext)
+        )
+        fd = os.open(
+            name,
+            os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0),
+            0o600,
+        )
+        raw = ctx.data()
+        data = repo.wwritedata(ctx.path(), raw)
+        del raw
+        # write straight to the fd; a buffered file object would only add
+        # another copy of the data.  memoryview slicing keeps the partial
+        # write loop copy-free.
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view) :]
+        finally:
+            os.close(fd)
         return name
 
     b = temp("base", fca)
@@ -916,17 +1128,33 @@ def _filemerge(premerge, repo, wctx, mynode, orig, fcd, fco, fca, labels=None):
     Returns whether the merge is complete, the return value of the merge, and
     a boolean indicating whether the file was deleted from disk."""
 
-    if not fco.cmp(fcd):  # files ide gtical?
+    # flags() goes through a manifest lookup; fetch each side once
+    fdflags = fcd.flags()
+    foflags = fco.flags()
+
+    # Matching filenodes mean identical contents, so equality there avoids
+    # fetching and comparing file data (the common case in large merges where
+    # one side left the file untouched).  Working copy contexts have no
+    # filenode and fall through to the content compare.
+    fconode = fco.filenode()
+    if (
+        not fcd.isabsent()
+        and not fco.isabsent()
+        and fconode is not None
+        and fconode != nullid
+        and fconode == fcd.filenode()
+        and foflags == fdflags
+    ):
+        return True, None, False
+
+    if not fco.cmp(fcd):  # files identical?
         return True, None, False
 
     ui = repo.ui
     fd = fcd.path()
-    relorig = repo.pathto(orig)
-    relfo = repo.pathto(fco.path())
-    relfd = repo.pathto(fd)
 
     binary = fcd.isbinary() or fco.isbinary() or fca.isbinary()
-    symlink = "l" in fcd.flags() + fco.flags()
+    symlink = "l" in fdflags + foflags
     changedelete = fcd.isabsent() or fco.isabsent()
     tool, toolpath = _picktool(repo, ui, fd, binary, symlink, changedelete)
     if tool in internals and tool.startswith("internal:"):
@@ -963,11 +1191,22 @@ def _filemerge(premerge, repo, wctx, mynode, orig, fcd, fco, fca, labels=None):
         r, deleted = func(repo, mynode, orig, fcd, fco, fca, toolconf, labels)
         return True, r, deleted
 
+    # relative paths are only needed for user-facing messages; resolving
+    # them is deferred so the tool-only paths don't pay for it
     if premerge:
         if orig != fco.path():
-            ui.status(_("merging %s and %s to %s\n") % (relorig, relfo, relfd))
+            # resolve the cwd once instead of per pathto call
+            cwd = repo.getcwd()
+            ui.status(
+                _("merging %s and %s to %s\n")
+                % (
+                    repo.pathto(orig, cwd),
+                    repo.pathto(fco.path(), cwd),
+                    repo.pathto(fd, cwd),
+                )
+            )
         else:
-            ui.status(_("merging %s\n") % relfd)
+            ui.status(_("merging %s\n") % repo.pathto(fd))
 
     ui.debug("my %s other %s ancestor %s\n" % (fcd, fco, fca))
 
@@ -976,7 +1215,7 @@ def _filemerge(premerge, repo, wctx, mynode, orig, fcd, fco, fca, labels=None):
         if callable(on_failure):
             return on_failure(num_conflicts, repo, mynode, orig, fcd, fco, fca)
         else:
-            return on_failure % relfd
+            return on_failure % repo.pathto(fd)
 
     if precheck and not precheck(repo, mynode, orig, fcd, fco, fca, toolconf):
         if onfailure:
@@ -1050,47 +1289,146 @@ def _onfilemergefailure(ui):
     # default action is 'continue', in which case we neither prompt nor halt
 
 
+# Optionally scan for all three conflict markers in one pass.  pyahocorasick
+# is not a hard dependency, and its stock build only indexes str, so fall back
+# to the bytes.find scan when the bytes automaton can't be built.
+_markersautomaton = None
+try:
+    import ahocorasick as _ahocorasick
+
+    _markersautomaton = _ahocorasick.Automaton()
+    for _marker in (b"<<<<<<< ", b"=======", b">>>>>>> "):
+        _markersautomaton.add_word(_marker, _marker)
+    _markersautomaton.make_automaton()
+except (ImportError, TypeError):
+    _markersautomaton = None
+
+
+def _markersindata(data):
+    """Returns True if data contains lines an unresolved conflict leaves
+    behind (equivalent to searching for ``^(<<<<<<< .*|=======|>>>>>>> .*)$``
+    multiline).
+
+    One Aho-Corasick pass over the buffer when the automaton is available;
+    otherwise bytes.find per marker, so the cost is a few C-level substring
+    scans plus O(1) anchoring work per candidate hit, instead of running a
+    regex state machine over every byte.
+    """
+    # In the common clean-merge case no marker literal occurs anywhere, so
+    # answer that with three C-level membership scans before paying for the
+    # per-hit iteration of either full path.  The anchored scans below only
+    # run when a marker-shaped substring actually exists.
+    if (
+        b"<<<<<<< " not in data
+        and b"=======" not in data
+        and b">>>>>>> " not in data
+    ):
+        return False
+    if _markersautomaton is not None:
+        for end, marker in _markersautomaton.iter(data):
+            start = end - len(marker) + 1
+            if start > 0 and data[start - 1 : start] != b"\n":
+                continue
+            if marker == b"=======" and data[end + 1 : end + 2] not in (b"", b"\n"):
+                continue
+            return True
+        return False
+    for marker in (b"<<<<<<< ", b">>>>>>> "):
+        i = data.find(marker)
+        while i != -1:
+            if i == 0 or data[i - 1 : i] == b"\n":
+                return True
+            i = data.find(marker, i + 1)
+    # "=======" must make up a whole line on its own
+    i = data.find(b"=======")
+    while i != -1:
+        if (i == 0 or data[i - 1 : i] == b"\n") and data[i + 7 : i + 8] in (
+            b"",
+            b"\n",
+        ):
+            return True
+        i = data.find(b"=======", i + 1)
+    return False
+
+
+def findconflictfiles(fctxs):
+    """Returns the given filectx-like objects whose contents contain conflict
+    marker lines.
+
+    Lets callers that merged a batch of files divide the post-merge conflict
+    checking in one place; each buffer takes one _markersindata scan.  The
+    buffers are deliberately not concatenated for a single automaton pass:
+    joining them would copy every byte once more in Python, which costs more
+    than the per-buffer scan startup it would save.
+    """
+    return [fctx for fctx in fctxs if _markersindata(fctx.data())]
+
+
+_toolcheckprofile = collections.namedtuple(
+    "_toolcheckprofile", ["checkconflicts", "checkprompt", "checkchanged", "fixeol"]
+)
+
+
+def _checkprofile(ui, tool):
+    """Resolve a tool's post-merge check settings into a flat profile.
+
+    _check runs once per merged file; with the profile memoized per-ui the
+    per-file cost is four attribute reads instead of re-deriving each flag
+    from the check list and booleans.
+    """
+    cache = _toolcfgcache(ui)
+    key = ("checkprofile", tool)
+    try:
+        return cache[key]
+    except KeyError:
+        checks = frozenset(_toollist(ui, tool, "check"))
+        profile = _toolcheckprofile(
+            checkconflicts=_toolbool(ui, tool, "checkconflicts")
+            or "conflicts" in checks,
+            checkprompt="prompt" in checks,
+            checkchanged=_toolbool(ui, tool, "checkchanged") or "changed" in checks,
+            fixeol=_toolbool(ui, tool, "fixeol"),
+        )
+        cache[key] = profile
+        return profile
+
+
 def _check(repo, r, ui, tool, fcd, files):
     fd = fcd.path()
     unused, unused, unused, back = files
+    data = None  # merged contents; read at most once, only if a check needs it
+    profile = _checkprofile(ui, tool)
 
-    if not r and (
-        _toolbool(ui, tool, "checkconflicts")
-        or "conflicts" in _toollist(ui, tool, "check")
-    ):
-        if re.search(b"^(<<<<<<< .*|=======|>>>>>>> .*)$", fcd.data(), re.MULTILINE):
+    if not r and profile.checkconflicts:
+        data = fcd.data()
+        if _markersindata(data):
             r = 1
 
     checked = False
-    if "prompt" in _toollist(ui, tool, "check"):
+    if profile.checkprompt:
         checked = True
-        if ui.promptchoice(
-            _("was merge of '%s' successful (yn)?" "$$ &Yes $$ &No") % fd, 1
-        ):
+        if ui.promptchoice(_mergesuccessmsg % fd, 1):
             r = 1
 
-    if (
-        not r
-        and not checked
-        and (
-            _toolbool(ui, tool, "checkchanged")
-            or "changed" in _toollist(ui, tool, "check")
-        )
-    ):
-        if back is not None and not fcd.cmp(back):
-            if ui.promptchoice(
-                _(
-                    " output file %s appears unchanged\n"
-                    "was merge successful (yn)?"
-                    "$$ &Yes $$ &No"
-                )
-                % fd,
-                1,
-            ):
+    if not r and not checked and profile.checkchanged:
+        if back is not None:
+            if data is not None:
+                # reuse the contents the conflict check already read instead
+                # of re-materializing them through fcd.cmp; a merge almost
+                # always changes the size, so a stat answers most cases
+                # without reading the backup at all
+                unchanged = back.size() == len(data) and back.data() == data
+            else:
+                unchanged = not fcd.cmp(back)
+        else:
+            unchanged = False
+        if unchanged:
+            if ui.promptchoice(_outputunchangedmsg % fd, 1):
                 r = 1
 
-    if back is not None and _toolbool(ui, tool, "fixeol"):
-        _matcheol(_workingpath(repo, fcd), back)
+    if back is not None and profile.fixeol:
+        # _workingpath inlined to spare a call frame on the per-file path
+        _matcheol(repo.wjoin(fd), back)
 
     return r
 
@@ -1109,15 +1447,17 @@ def filemerge(repo, wctx, mynode, orig, fcd, fco, fca, labels=None):
 
 def loadinternalmerge(ui, extname, registrarobj):
     """Load internal merge tool from specified registrarobj"""
-    for name, func in registrarobj._table.items():
-        fullname = ":" + name
-        internals[fullname] = func
-        internals["internal:" + name] = func
-        internalsdoc[fullname] = func
+    items = list(registrarobj._table.items())
+    internals.update((":" + name, func) for name, func in items)
+    internals.update(("internal:" + name, func) for name, func in items)
+    internalsdoc.update((":" + name, func) for name, func in items)
 
+    # tell hggettext to extract docstrings from these functions.  A tuple
+    # snapshot rather than a live view of internals, re-taken here so tools
+    # registered by extensions are picked up too.
+    global i18nfunctions
+    i18nfunctions = tuple(internals.values())
 
-# load built-in merge tools explicitly to setup internalsdoc
-loadinternalmerge(None, None, internaltool)
 
-# tell hggettext to extract docstrings from these functions:
-i18nfunctions = internals.values()
+# load built-in merge tools explicitly to setup internalsdoc and i18nfunctions
+loadinternalmerge(None, None, internaltool)
@@ -101,12 +101,7 @@ class Merge3Text(object):
         """Return merge in cvs-like form."""
         self.conflicts = False
         self.conflictscount = 0
-        newline = b"\n"
-        if len(self.a) > 0:
-            if self.a[0].endswith(b"\r\n"):
-                newline = b"\r\n"
-            elif self.a[0].endswith(b"\r"):
-                newline = b"\r"
+        newline = self.markernewline()
         if name_a and start_marker:
             start_marker = start_marker + b" " + name_a
         if name_b and end_marker:
@@ -154,6 +149,20 @@ class Merge3Text(object):
             else:
                 raise ValueError(what)
 
+    def markernewline(self):
+        """Guess the newline to terminate generated marker lines with.
+
+        Matching the local side's EOL style keeps merge output from mixing
+        line endings, which would otherwise need a whole-file rewrite to fix
+        up afterwards.
+        """
+        if len(self.a) > 0:
+            if self.a[0].endswith(b"\r\n"):
+                return b"\r\n"
+            if self.a[0].endswith(b"\r"):
+                return b"\r"
+        return b"\n"
+
     def merge_groups(self):
         """Yield sequence of line groups.  Each one is a tuple:
 
@@ -431,6 +440,7 @@ def _picklabels(defaults, overrides):
 def _mergediff(m3, name_a, name_b, name_base):
     lines = []
     conflicts = False
+    newline = m3.markernewline()
     for group in m3.merge_groups():
         if group[0] == "conflict":
             base_lines, a_lines, b_lines = group[1:]
@@ -466,20 +476,20 @@ def _mergediff(m3, name_a, name_b, name_base):
                         for line in lines2[block[2] : block[3]]:
                             yield b"+" + line
 
-            lines.append(b"<<<<<<<\n")
+            lines.append(b"<<<<<<<" + newline)
             if matchinglines(ablocks) < matchinglines(bblocks):
-                lines.append(b"======= %s\n" % name_a)
+                lines.append(b"======= %s" % name_a + newline)
                 lines.extend(a_lines)
-                lines.append(b"------- %s\n" % name_base)
-                lines.append(b"+++++++ %s\n" % name_b)
+                lines.append(b"------- %s" % name_base + newline)
+                lines.append(b"+++++++ %s" % name_b + newline)
                 lines.extend(difflines(bblocks, base_lines, b_lines))
             else:
-                lines.append(b"------- %s\n" % name_base)
-                lines.append(b"+++++++ %s\n" % name_a)
+                lines.append(b"------- %s" % name_base + newline)
+                lines.append(b"+++++++ %s" % name_a + newline)
                 lines.extend(difflines(ablocks, base_lines, a_lines))
-                lines.append(b"======= %s\n" % name_b)
+                lines.append(b"======= %s" % name_b + newline)
                 lines.extend(b_lines)
-            lines.append(b">>>>>>>\n")
+            lines.append(b">>>>>>>" + newline)
             conflicts = True
         else:
             lines.extend(group[1])
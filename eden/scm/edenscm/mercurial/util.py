@@ -1304,6 +1304,33 @@ def checksignature(func):
     return check
 
 
+def _copyfilecontents(src, dest):
+    """copy file contents, using an in-kernel copy when available
+
+    os.copy_file_range avoids bouncing the data through userspace and lets
+    filesystems like btrfs or NFS 4.2 share or server-side copy the blocks.
+    Falls back to shutil.copyfile when the syscall is missing or the involved
+    filesystems don't support it (EXDEV before Linux 5.3, EINVAL, ...).
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    if copy_file_range is not None:
+        try:
+            with posixfile(src, "rb") as fsrc, posixfile(dest, "wb") as fdst:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    copied = copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if copied == 0:
+                        # source shrank under us; copy whatever is left the
+                        # portable way
+                        shutil.copyfileobj(fsrc, fdst)
+                        break
+                    remaining -= copied
+            return
+        except OSError:
+            pass  # fall back to the portable copy
+    shutil.copyfile(src, dest)
+
+
 def copyfile(src, dest, hardlink=False, copystat=False, checkambig=False):
     """copy a file, preserving mode and optionally other stat info like
     atime/mtime
@@ -1338,7 +1365,7 @@ def copyfile(src, dest, hardlink=False, copystat=False, checkambig=False):
         # for them anyway
     else:
         try:
-            shutil.copyfile(src, dest)
+            _copyfilecontents(src, dest)
             if copystat:
                 # copystat also copies mode
                 shutil.copystat(src, dest)